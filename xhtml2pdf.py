@@ -52,70 +52,286 @@ Convert XML + XSLT -> XHTML (lxml) -> PDF (WeasyPrint 52.5)
 
 Usage:
   python convert_weasy.py input.xml style.xsl output.pdf
+  python convert_weasy.py --batch xml_dir/ style.xsl pdf_dir/ [--jobs N]
+  python convert_weasy.py input.xml style.xsl output.pdf --engine saxon
 
 Notes:
 - Does NOT modify XML or XSL.
 - Uses base_url so relative images/CSS referenced by the generated XHTML resolve.
+- The compiled XSLT is cached per stylesheet, so converting many XML files
+  with the same XSL only parses and compiles it once.
+- --engine saxon runs the XSLT with SaxonC-HE (pip install saxonche), which
+  supports XSLT 2.0/3.0 and is faster on heavy stylesheets than libxslt.
 """
 
+import argparse
+import logging
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from lxml import etree
-from weasyprint import HTML
+from weasyprint import HTML, default_url_fetcher
+
+try:
+    from saxonche import PySaxonProcessor
+except ImportError:  # optional: only needed for --engine saxon
+    PySaxonProcessor = None
+
+
+# WeasyPrint logs a warning per ignored CSS rule; nothing here shows them, so don't build the records.
+logging.getLogger("weasyprint").setLevel(logging.ERROR)
+logging.getLogger("fontTools").setLevel(logging.ERROR)
+
+_SAFE_PARSER = etree.XMLParser(
+    resolve_entities=False,
+    no_network=True,
+    recover=False,
+    huge_tree=False,
+    remove_blank_text=False,
+)
+
+# Files up to this size are parsed from memory; larger ones stream from disk so the raw
+# bytes and the tree are never held together.
+_IN_MEMORY_PARSE_LIMIT = 8 * 1024 * 1024
+
+_XHTML_NS = "http://www.w3.org/1999/xhtml"
+
+# Compiled stylesheets keyed by (path, mtime_ns); an edited XSL gets a new key.
+_XSLT_CACHE: dict[tuple[str, int], etree.XSLT] = {}
+_SAXON_CACHE: dict[tuple[str, int], object] = {}
+# The Xslt30 processor must not outlive the PySaxonProcessor that created it.
+_SAXON_PROCESSOR = None
+_SAXON_XSLT30 = None
+
+
+def get_transform(xsl_path: Path) -> etree.XSLT:
+    """Return the compiled XSLT for xsl_path, parsing and compiling it only once."""
+    key = (str(xsl_path), xsl_path.stat().st_mtime_ns)
+    transform = _XSLT_CACHE.get(key)
+    if transform is None:
+        xsl_doc = etree.parse(str(xsl_path), _SAFE_PARSER)
+        transform = _XSLT_CACHE[key] = etree.XSLT(xsl_doc)
+    return transform
+
+
+def xml_xsl_to_xhtml(xml_path: Path, xsl_path: Path) -> bytes:
+    """Apply XSLT to XML and return XHTML as UTF-8 bytes."""
+    if xml_path.stat().st_size <= _IN_MEMORY_PARSE_LIMIT:
+        # Parse from memory, skipping libxml2's file/URI loader. base_url keeps
+        # document() paths relative to the XML.
+        xml_doc = etree.fromstring(
+            xml_path.read_bytes(), _SAFE_PARSER, base_url=str(xml_path)
+        ).getroottree()
+    else:
+        xml_doc = etree.parse(str(xml_path), _SAFE_PARSER)
+
+    transform = get_transform(xsl_path)
+    result = transform(xml_doc)
+    # Drop the source tree before serializing so both never peak together.
+    del xml_doc
+
+    root = result.getroot()
+    if root is None:
+        # <xsl:output method="text">: bytes() gives the text itself (UTF-8 by default).
+        return bytes(result)
+
+    # WeasyPrint parses HTML, where <div/> is an unclosed start tag, so serialize as HTML.
+    # libxml2 only recognizes void elements like <br> outside a namespace, so drop the
+    # XHTML namespace first; otherwise it writes <br></br>, which html5lib reads as two.
+    for el in root.iter(f"{{{_XHTML_NS}}}*"):
+        el.tag = etree.QName(el).localname
+    etree.cleanup_namespaces(result)
+    return etree.tostring(result, method="html", encoding="utf-8")
+
+
+def _declared_output_method(xsl_path: Path) -> str | None:
+    """Return the method of the stylesheet's top-level <xsl:output>, if it declares one."""
+    xsl_doc = etree.parse(str(xsl_path), _SAFE_PARSER)
+    methods = xsl_doc.xpath(
+        "/xsl:*/xsl:output/@method", namespaces={"xsl": "http://www.w3.org/1999/XSL/Transform"}
+    )
+    return methods[-1].strip() if methods else None
+
+
+def get_saxon_executable(xsl_path: Path):
+    """Return the SaxonC executable for xsl_path, compiling it only once."""
+    global _SAXON_PROCESSOR, _SAXON_XSLT30
+    if _SAXON_XSLT30 is None:
+        _SAXON_PROCESSOR = PySaxonProcessor(license=False)
+        _SAXON_XSLT30 = _SAXON_PROCESSOR.new_xslt30_processor()
+
+    key = (str(xsl_path), xsl_path.stat().st_mtime_ns)
+    executable = _SAXON_CACHE.get(key)
+    if executable is None:
+        executable = _SAXON_XSLT30.compile_stylesheet(stylesheet_file=str(xsl_path))
+        # transform_to_string() always decodes as UTF-8, whatever <xsl:output> declares.
+        executable.set_property("!encoding", "UTF-8")
+        if _declared_output_method(xsl_path) in (None, "xml"):
+            # XML output would give <div/>, which html5lib reads as an unclosed start tag.
+            # XHTML serialization writes <div></div> and <br/> instead; it would also
+            # indent by default, which adds whitespace the lxml path doesn't.
+            # html/xhtml/text stylesheets keep the method they declare.
+            executable.set_property("!method", "xhtml")
+            executable.set_property("!html-version", "5")
+            executable.set_property("!omit-xml-declaration", "yes")
+            executable.set_property("!indent", "no")
+        _SAXON_CACHE[key] = executable
+    return executable
+
+
+def xml_xsl_to_xhtml_saxon(xml_path: Path, xsl_path: Path) -> bytes:
+    """Apply XSLT to XML with SaxonC and return XHTML as UTF-8 bytes."""
+    executable = get_saxon_executable(xsl_path)
+    return executable.transform_to_string(source_file=str(xml_path)).encode("utf-8")
+
+
+@lru_cache(maxsize=64)
+def _fetch_local_file(url: str) -> dict:
+    result = default_url_fetcher(url)
+    if "file_obj" in result:
+        file_obj = result.pop("file_obj")
+        with file_obj:
+            result["string"] = file_obj.read()
+    return result
+
+
+def cached_url_fetcher(url: str) -> dict:
+    """WeasyPrint url_fetcher that keeps recently used local files (logo, CSS, ...) in memory."""
+    # Only file: URLs are shared across documents. data: URIs (embedded images) are unique
+    # per document and WeasyPrint already caches them for the document being rendered.
+    if not url.startswith("file:"):
+        return default_url_fetcher(url)
+    # WeasyPrint fills in defaults on the dict it gets back, so hand out a copy.
+    return dict(_fetch_local_file(url))
+
+
+def xhtml_to_pdf(xhtml: bytes, pdf_path: Path, base_url: str) -> None:
+    """Render UTF-8 XHTML bytes to PDF with WeasyPrint."""
+    pdf = HTML(
+        string=xhtml, encoding="utf-8", base_url=base_url, url_fetcher=cached_url_fetcher
+    ).write_pdf()
+    # One write of the finished PDF rather than a chunked copy; matters on network filesystems.
+    pdf_path.parent.mkdir(parents=True, exist_ok=True)
+    pdf_path.write_bytes(pdf)
 
 
-def xml_xsl_to_xhtml(xml_path: Path, xsl_path: Path) -> str:
-    """Apply XSLT to XML and return XHTML as a string."""
-    parser = etree.XMLParser(
-        resolve_entities=False,
-        no_network=True,
-        recover=False,
-        huge_tree=False,
-        remove_blank_text=False,
-    )
+def convert_one(
+    xml_path: Path, xsl_path: Path, pdf_path: Path, base_dir: Path, engine: str = "lxml"
+) -> Path:
+    """Convert a single XML file to PDF; used directly and as the batch task."""
+    # 1) XML + XSL -> XHTML
+    if engine == "saxon":
+        xhtml = xml_xsl_to_xhtml_saxon(xml_path, xsl_path)
+    else:
+        xhtml = xml_xsl_to_xhtml(xml_path, xsl_path)
 
-    xml_doc = etree.parse(str(xml_path), parser)
-    xsl_doc = etree.parse(str(xsl_path), parser)
+    # Optional: write the generated XHTML for debugging
+    # debug_path = xml_path.parent / "debug.xhtml"
+    # debug_path.write_bytes(xhtml)
 
-    transform = etree.XSLT(xsl_doc)
-    result = transform(xml_doc)
+    # 2) XHTML -> PDF
+    # base_url is important for resolving relative URLs in <img src="...">, <link href="...">, etc.
+    xhtml_to_pdf(xhtml, pdf_path, str(base_dir))
+    return pdf_path
 
-    return str(result)
 
+def _convert_task(*args) -> Path:
+    # lxml and saxonche exceptions hold error logs that can't be pickled back to the
+    # parent, which would replace the real cause with a pickling error.
+    try:
+        return convert_one(*args)
+    except Exception as exc:
+        raise RuntimeError(f"{type(exc).__name__}: {exc}") from None
 
-def xhtml_to_pdf(xhtml: str, pdf_path: Path, base_url: str) -> None:
-    """Render XHTML string to PDF with WeasyPrint."""
-    pdf_path.parent.mkdir(parents=True, exist_ok=True)
-    HTML(string=xhtml, base_url=base_url).write_pdf(str(pdf_path))
 
+def _init_worker(xsl_path: Path, engine: str) -> None:
+    # Compiled stylesheets can't be pickled, so each worker compiles its own copy up front.
+    if engine == "saxon":
+        get_saxon_executable(xsl_path)
+    else:
+        get_transform(xsl_path)
 
-def main() -> int:
-    if len(sys.argv) != 4:
-        print("Usage: python convert_weasy.py input.xml style.xsl output.pdf")
-        return 2
 
-    xml_path = Path(sys.argv[1]).expanduser().resolve()
-    xsl_path = Path(sys.argv[2]).expanduser().resolve()
-    pdf_path = Path(sys.argv[3]).expanduser().resolve()
+def convert_batch(xml_dir: Path, xsl_path: Path, out_dir: Path, jobs: int, engine: str) -> int:
+    """Convert every *.xml in xml_dir to out_dir/<name>.pdf using a process pool."""
+    xml_paths = sorted(xml_dir.glob("*.xml"))
+    if not xml_paths:
+        print(f"ERROR: no *.xml files in: {xml_dir}", file=sys.stderr)
+        return 1
 
-    if not xml_path.exists():
-        print(f"ERROR: XML not found: {xml_path}", file=sys.stderr)
+    failed = 0
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(xsl_path, engine)
+    ) as pool:
+        futures = {
+            pool.submit(
+                _convert_task,
+                xml_path,
+                xsl_path,
+                out_dir / f"{xml_path.stem}.pdf",
+                xml_path.parent,
+                engine,
+            ): xml_path
+            for xml_path in xml_paths
+        }
+        for future in as_completed(futures):
+            xml_path = futures[future]
+            try:
+                pdf_path = future.result()
+            except Exception as exc:
+                failed += 1
+                print(f"ERROR: {xml_path}: {exc}", file=sys.stderr)
+            else:
+                print(f"✅ PDF generated: {pdf_path}")
+
+    return 1 if failed else 0
+
+
+def _positive_int(value: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value!r}")
+    return n
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Convert XML + XSLT -> XHTML -> PDF (WeasyPrint)")
+    ap.add_argument("input", help="input XML file (or directory of *.xml with --batch)")
+    ap.add_argument("xsl", help="XSLT stylesheet")
+    ap.add_argument("output", help="output PDF file (or output directory with --batch)")
+    ap.add_argument("--batch", action="store_true", help="convert every *.xml in the input directory")
+    ap.add_argument("--jobs", type=_positive_int, default=os.cpu_count(), help="worker processes for --batch")
+    ap.add_argument("--engine", choices=("lxml", "saxon"), default="lxml", help="XSLT processor")
+    args = ap.parse_args()
+
+    if args.engine == "saxon" and PySaxonProcessor is None:
+        print("ERROR: --engine saxon needs the saxonche package (pip install saxonche)", file=sys.stderr)
         return 1
+
+    xml_path = Path(args.input).expanduser().resolve()
+    xsl_path = Path(args.xsl).expanduser().resolve()
+    pdf_path = Path(args.output).expanduser().resolve()
+
     if not xsl_path.exists():
         print(f"ERROR: XSL not found: {xsl_path}", file=sys.stderr)
         return 1
 
-    # 1) XML + XSL -> XHTML
-    xhtml = xml_xsl_to_xhtml(xml_path, xsl_path)
+    if args.batch:
+        if not xml_path.is_dir():
+            print(f"ERROR: XML directory not found: {xml_path}", file=sys.stderr)
+            return 1
+        return convert_batch(xml_path, xsl_path, pdf_path, args.jobs, args.engine)
 
-    # Optional: write the generated XHTML for debugging
-    # debug_path = xml_path.parent / "debug.xhtml"
-    # debug_path.write_text(xhtml, encoding="utf-8")
+    if not xml_path.exists():
+        print(f"ERROR: XML not found: {xml_path}", file=sys.stderr)
+        return 1
 
-    # 2) XHTML -> PDF
-    # base_url is important for resolving relative URLs in <img src="...">, <link href="...">, etc.
-    base_url = str(xml_path.parent)
-    xhtml_to_pdf(xhtml, pdf_path, base_url)
+    convert_one(xml_path, xsl_path, pdf_path, xml_path.parent, args.engine)
 
     print(f"✅ PDF generated: {pdf_path}")
     return 0
@@ -131,18 +347,32 @@ From the same folder (or give full paths):
 micromamba activate wp
 python convert_weasy.py input.xml style.xsl output.pdf
 
+To convert a whole folder of XML files with the same XSL, use --batch. Each
+*.xml in the input folder becomes <name>.pdf in the output folder, spread over
+one worker process per CPU core (override with --jobs N):
+
+python convert_weasy.py --batch xml_dir/ style.xsl pdf_dir/ --jobs 4
+
+For XSLT 2.0/3.0 stylesheets, or when the same heavy stylesheet is applied to
+thousands of files, run the transform with SaxonC-HE instead of lxml. It is an
+optional extra; install it into the same env first:
+
+pip install saxonche
+python convert_weasy.py --batch xml_dir/ style.xsl pdf_dir/ --engine saxon
+
 D) If assets (images/css) are not found
 
-WeasyPrint resolves relative paths based on:
+WeasyPrint resolves relative paths based on the base_dir passed to convert_one(),
+which defaults to the XML’s own folder (in --batch mode too):
 
-base_url = str(xml_path.parent)
+base_url = str(base_dir)  # base_dir = xml_path.parent
 
 
 So ensure any referenced assets are reachable relative to the XML’s directory.
 
-If your assets live elsewhere, change base_url to that folder, e.g.:
+If your assets live elsewhere, pass that folder as base_dir instead, e.g.:
 
-base_url = "/path/to/assets"
+base_dir = Path("/path/to/assets")
 
 
 If your shell is not bash (e.g., csh/tcsh), tell me which one and I’ll give the exact activation commands for that shell too.